@@ -39,16 +39,11 @@ from collectors.memory import MemoryCollector
 from collectors.disk import DiskCollector
 from collectors.network import NetworkCollector
 from collectors.services import ServiceCollector
+from storage.tsdb import TimeSeriesStore, AGGREGATES, parse_duration, parse_time
+from outputs.fanout import FanOut, Target
+from aggregator.proxy import create_aggregator
 
-# Configure logging (will be updated from config)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('agent.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from logconfig import setup_logging
 
 logger = logging.getLogger(__name__)
 
@@ -58,6 +53,7 @@ class ShelterAgent(object):
         """Initialize agent with YAML configuration."""
         self.config = self.load_config(config_file)
         self.config_file = config_file
+        setup_logging(self.config.get('logging'))
         
         # Server settings
         self.server_url = self.config['server']['url']
@@ -75,6 +71,7 @@ class ShelterAgent(object):
         
         # API Token (self-generated)
         self.api_token = self.config['agent'].get('api_token', '')
+        self.unauthorized = False
         
         # Intervals
         intervals = self.config.get('intervals', {})
@@ -82,6 +79,7 @@ class ShelterAgent(object):
         self.send_interval = intervals.get('send', 30)
         self.service_interval = intervals.get('services', 60)
         self.heartbeat_interval = intervals.get('heartbeat', 10)
+        self.health_interval = intervals.get('health', 60)
         
         # Initialize collectors
         self.cpu_collector = CPUCollector()
@@ -90,11 +88,19 @@ class ShelterAgent(object):
         self.network_collector = NetworkCollector()
         self.service_collector = ServiceCollector()
         
+        # Local time-series store
+        self.local_store = self.open_local_store(self.config)
+        
+        # Additional servers; started after registration with server.url
+        self.targets_config = self.config.get('targets') or []
+        self.fanout = None
+        
         # Metrics buffer
         self.metrics_buffer = []
         self.last_send_time = time.time()
         self.last_service_update = time.time()
         self.last_heartbeat = time.time()
+        self.last_health_log = time.time()
         
         logger.info("Initialized ShelterAgent")
         logger.info("Agent ID: %s" % self.agent_id)
@@ -115,6 +121,26 @@ class ShelterAgent(object):
             logger.error("Failed to load config: %s" % str(e))
             sys.exit(1)
 
+    @staticmethod
+    def open_local_store(config, create=True):
+        """Open the local TSDB if enabled in the storage section."""
+        storage = config.get('storage') or {}
+        if not storage.get('enabled', False):
+            return None
+        
+        try:
+            return TimeSeriesStore(
+                storage.get('path', 'data'),
+                block_duration=storage.get('block_hours', 2) * 3600,
+                retention_days=storage.get('retention_days', 7),
+                max_size_mb=storage.get('max_size_mb', 100),
+                flush_interval=storage.get('flush_interval', 60),
+                create=create
+            )
+        except Exception as e:
+            logger.error("Failed to open local store: %s" % str(e))
+            return None
+
     def save_config(self):
         """Save configuration to YAML file."""
         try:
@@ -159,9 +185,9 @@ class ShelterAgent(object):
         api_token = hashlib.sha256(token_source.encode('utf-8')).hexdigest()
         return api_token
 
-    def register(self):
+    def register(self, validate=True):
         """Register this agent with the server."""
-        if self.api_token:
+        if self.api_token and validate:
             logger.info("Agent already has API token, validating...")
             # Try to send heartbeat to validate token
             if self.send_heartbeat():
@@ -173,32 +199,9 @@ class ShelterAgent(object):
         logger.info("Registering agent with server...")
         
         try:
-            import psutil
-            
             # Generate new API token
             new_api_token = self.generate_api_token()
-            
-            # Get total disk size
-            total_disk = 0
-            for part in psutil.disk_partitions(all=False):
-                try:
-                    usage = psutil.disk_usage(part.mountpoint)
-                    total_disk += usage.total
-                except (PermissionError, OSError):
-                    pass
-            
-            data = {
-                'agent_id': self.agent_id,
-                'hwid': self.hwid,
-                'hostname': self.hostname,
-                'ip_address': self.get_ip_address(),
-                'os_type': platform.system(),
-                'os_version': platform.platform(),
-                'cpu_cores': psutil.cpu_count(logical=True),
-                'total_memory': psutil.virtual_memory().total,
-                'total_disk': total_disk,
-                'api_token': new_api_token,
-            }
+            data = self.registration_data(new_api_token)
             
             response = self.http_post(
                 self.server_url + '/agent/register',
@@ -207,6 +210,7 @@ class ShelterAgent(object):
             
             if response and response.get('success'):
                 self.api_token = new_api_token
+                self.unauthorized = False
                 
                 # Update config
                 self.config['agent']['hwid'] = self.hwid
@@ -223,10 +227,98 @@ class ShelterAgent(object):
                 
         except Exception as e:
             logger.error("Registration error: %s" % str(e))
-            import traceback
-            traceback.print_exc()
+            logger.debug("Registration traceback", exc_info=True)
             return False
 
+    def token_rejected(self):
+        """True if server.url answered 401 to our API token."""
+        if self.fanout is not None:
+            return self.fanout.targets[0].unauthorized
+        return self.unauthorized
+
+    def reregister(self):
+        """Register again with a new token after the server rejected ours."""
+        import json
+        
+        logger.warning("API token rejected by server, re-registering...")
+        old_token = self.api_token
+        self.unauthorized = False
+        if not self.register(validate=False):
+            return False
+        
+        if self.fanout is not None:
+            # Targets registered with our old token get the new one too
+            registration = json.dumps(self.registration_data(self.api_token)).encode('utf-8')
+            for target in self.fanout.targets:
+                if target.api_token != old_token:
+                    continue
+                if target.registration is not None:
+                    target.set_token(self.api_token, registration)
+                else:
+                    target.set_token(self.api_token)
+        return True
+
+    def registration_data(self, api_token):
+        """Build the /agent/register payload for the given token."""
+        import psutil
+        
+        # Get total disk size
+        total_disk = 0
+        for part in psutil.disk_partitions(all=False):
+            try:
+                usage = psutil.disk_usage(part.mountpoint)
+                total_disk += usage.total
+            except (PermissionError, OSError):
+                pass
+        
+        return {
+            'agent_id': self.agent_id,
+            'hwid': self.hwid,
+            'hostname': self.hostname,
+            'ip_address': self.get_ip_address(),
+            'os_type': platform.system(),
+            'os_version': platform.platform(),
+            'cpu_cores': psutil.cpu_count(logical=True),
+            'total_memory': psutil.virtual_memory().total,
+            'total_disk': total_disk,
+            'api_token': api_token,
+        }
+
+    def start_fanout(self):
+        """Start fan-out delivery to server.url plus the configured targets."""
+        import json
+        
+        targets = [Target('primary', self.server_url, self.api_token, self.verify_ssl)]
+        registration = None
+        
+        for i, cfg in enumerate(self.targets_config):
+            name = cfg.get('name') or 'target-%d' % (i + 1)
+            url = cfg.get('url', '')
+            if not url.startswith('https://'):
+                logger.error("Target %s skipped: URL must use HTTPS" % name)
+                continue
+            
+            # Targets without their own token are registered with ours
+            api_token = cfg.get('api_token')
+            target_registration = None
+            if not api_token:
+                if registration is None:
+                    registration = json.dumps(self.registration_data(self.api_token)).encode('utf-8')
+                api_token = self.api_token
+                target_registration = registration
+            
+            targets.append(Target(
+                name, url, api_token,
+                verify_ssl=cfg.get('verify_ssl', True),
+                timeout=cfg.get('timeout', 10),
+                batch_size=cfg.get('batch_size', 1000),
+                queue_size=cfg.get('queue_size', 5000),
+                registration=target_registration
+            ))
+            logger.info("Fan-out target %s: %s" % (name, url))
+        
+        return FanOut(self.agent_id, targets)
+
     def get_ip_address(self):
         """Get local IP address."""
         try:
@@ -277,12 +369,21 @@ class ShelterAgent(object):
                 response_data = response_data.decode('utf-8')
             
             return json.loads(response_data)
+        except urllib2.HTTPError as e:
+            if e.code == 401:
+                self.unauthorized = True
+            logger.error("HTTP POST error to %s: %s" % (url, str(e)))
+            return None
         except Exception as e:
             logger.error("HTTP POST error to %s: %s" % (url, str(e)))
             return None
 
     def send_heartbeat(self):
         """Send heartbeat to server."""
+        if self.fanout is not None:
+            self.fanout.publish('/agent/heartbeat', {'agent_id': self.agent_id})
+            return True
+        
         try:
             headers = {'Authorization': 'Bearer %s' % self.api_token}
             data = {'agent_id': self.agent_id}
@@ -354,11 +455,28 @@ class ShelterAgent(object):
             logger.error("Error collecting metrics: %s" % str(e))
             return []
 
+    def store_metrics(self, metrics, timestamp):
+        """Append collected metrics to the local store."""
+        if self.local_store is None or not metrics:
+            return
+        
+        try:
+            self.local_store.append_metrics(metrics, timestamp)
+        except Exception as e:
+            logger.error("Error storing metrics locally: %s" % str(e))
+
     def send_metrics(self):
         """Send buffered metrics to server."""
         if not self.metrics_buffer:
             return True
         
+        if self.fanout is not None:
+            # Queued per target; delivery happens in the background
+            self.fanout.publish_metrics(self.metrics_buffer)
+            logger.debug("Queued %d metrics for %d targets" % (len(self.metrics_buffer), len(self.fanout.targets)))
+            self.metrics_buffer = []
+            return True
+        
         try:
             headers = {'Authorization': 'Bearer %s' % self.api_token}
             data = {
@@ -385,6 +503,19 @@ class ShelterAgent(object):
             logger.error("Error sending metrics: %s" % str(e))
             return False
 
+    def log_fanout_health(self):
+        """Log queue depth, drops and last error of every fan-out target."""
+        for health in self.fanout.health():
+            logger.info("Target %s: %s, queued %d, sent %d, dropped %d, rejected %d%s" % (
+                health['name'],
+                'healthy' if health['healthy'] else 'unavailable (%d failures)' % health['failures'],
+                health['queued_metrics'],
+                health['sent_metrics'],
+                health['dropped_metrics'],
+                health['rejected_requests'],
+                ', last error: %s' % health['last_error'] if health['last_error'] else ''
+            ))
+
     def send_services(self):
         """Collect and send services data."""
         try:
@@ -394,6 +525,13 @@ class ShelterAgent(object):
                 logger.info("No services to send")
                 return True
             
+            if self.fanout is not None:
+                self.fanout.publish('/services', {
+                    'agent_id': self.agent_id,
+                    'services': services
+                })
+                return True
+            
             headers = {'Authorization': 'Bearer %s' % self.api_token}
             data = {
                 'agent_id': self.agent_id,
@@ -418,8 +556,7 @@ class ShelterAgent(object):
                 
         except Exception as e:
             logger.error("Error sending services: %s" % str(e))
-            import traceback
-            traceback.print_exc()
+            logger.debug("Send services traceback", exc_info=True)
             return False
 
     def run(self):
@@ -438,6 +575,9 @@ class ShelterAgent(object):
                 logger.error("Failed to validate token. Exiting...")
                 sys.exit(1)
         
+        if self.targets_config:
+            self.fanout = self.start_fanout()
+        
         logger.info("Agent running. Press Ctrl+C to stop.")
         
         try:
@@ -447,6 +587,7 @@ class ShelterAgent(object):
                 # Collect metrics
                 metrics = self.collect_metrics()
                 self.metrics_buffer.extend(metrics)
+                self.store_metrics(metrics, current_time)
                 
                 # Send metrics if interval elapsed
                 if current_time - self.last_send_time >= self.send_interval:
@@ -461,8 +602,15 @@ class ShelterAgent(object):
                 # Send heartbeat
                 if current_time - self.last_heartbeat >= self.heartbeat_interval:
                     self.send_heartbeat()
+                    if self.token_rejected():
+                        self.reregister()
                     self.last_heartbeat = current_time
                 
+                # Report fan-out target health
+                if self.fanout is not None and current_time - self.last_health_log >= self.health_interval:
+                    self.log_fanout_health()
+                    self.last_health_log = current_time
+                
                 # Sleep until next collection
                 time.sleep(self.collection_interval)
                 
@@ -471,9 +619,132 @@ class ShelterAgent(object):
             # Send remaining metrics
             if self.metrics_buffer:
                 self.send_metrics()
+            if self.fanout is not None:
+                self.fanout.close()
+            if self.local_store is not None:
+                self.local_store.close()
             logger.info("Agent stopped")
 
 
-if __name__ == '__main__':
-    agent = ShelterAgent()
+def query_local_store(args):
+    """Print samples or aggregates from the local store."""
+    if not os.path.exists(args.config):
+        print("Config file not found: %s" % args.config)
+        return 1
+    
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f) or {}
+    
+    # Query an existing store even if collection is currently disabled
+    storage = dict(config.get('storage') or {}, enabled=True)
+    store = ShelterAgent.open_local_store({'storage': storage}, create=False)
+    if store is None:
+        return 1
+    
+    if not args.series:
+        for name in store.series():
+            print(name)
+        return 0
+    
+    now = time.time()
+    try:
+        start = parse_time(args.start, now)
+        end = parse_time(args.end, now)
+        step = parse_duration(args.step) if args.step is not None else None
+        
+        if args.agg:
+            result = store.aggregate(args.series, start, end, args.agg, step)
+            if step is None:
+                result = [(start, result)] if result is not None else []
+        else:
+            result = store.query(args.series, start, end)
+    except ValueError as e:
+        print("Error: %s" % str(e))
+        return 1
+    
+    if args.json:
+        import json
+        print(json.dumps([{'timestamp': t, 'value': v} for t, v in result]))
+    else:
+        for t, v in result:
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+            print("%s  %s" % (stamp, v))
+    return 0
+
+
+def run_aggregator(args):
+    """Run the edge aggregator until interrupted."""
+    if not os.path.exists(args.config):
+        print("Config file not found: %s" % args.config)
+        return 1
+    
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f) or {}
+    setup_logging(config.get('logging'))
+    
+    server_url = (config.get('server') or {}).get('url', '')
+    if not server_url.startswith('https://'):
+        logger.error("Server URL must use HTTPS!")
+        return 1
+    
+    settings = config.get('aggregator') or {}
+    if not settings.get('certfile') or not settings.get('keyfile'):
+        logger.error("aggregator.certfile and aggregator.keyfile are required")
+        return 1
+    
+    aggregator_id = settings.get('id') or socket.gethostname()
+    try:
+        server, batcher = create_aggregator(config, aggregator_id)
+    except Exception as e:
+        logger.error("Failed to start aggregator: %s" % str(e))
+        return 1
+    
+    batcher.start()
+    logger.info("Aggregator %s listening on %s:%d, forwarding to %s"
+                % (aggregator_id, server.server_address[0], server.server_address[1], server_url))
+    
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down aggregator...")
+    finally:
+        server.server_close()
+        batcher.close()
+        logger.info("Aggregator stopped: %s" % batcher.stats)
+    return 0
+
+
+def main():
+    """Command line entry point."""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='ShelterAgent - System Monitoring Agent')
+    parser.add_argument('-c', '--config', default='config.yml', help='Path to config.yml')
+    subparsers = parser.add_subparsers(dest='command')
+    
+    subparsers.add_parser('run', help='Run the agent (default)')
+    
+    query = subparsers.add_parser('query', help='Query the local metrics store')
+    query.add_argument('series', nargs='?', help='Metric type, e.g. cpu (omit to list series)')
+    query.add_argument('--start', default='now-1h', help="Start time: 'now', 'now-1h' or epoch seconds")
+    query.add_argument('--end', default='now', help="End time: 'now', 'now-5m' or epoch seconds")
+    query.add_argument('--agg', choices=AGGREGATES, help='Aggregate function')
+    query.add_argument('--step', help="Bucket size for --agg, e.g. '1m'")
+    query.add_argument('--json', action='store_true', help='Print JSON instead of text')
+    
+    subparsers.add_parser('aggregate', help='Run as an aggregator for local agents')
+    
+    args = parser.parse_args()
+    
+    if args.command == 'query':
+        return query_local_store(args)
+    if args.command == 'aggregate':
+        return run_aggregator(args)
+    
+    agent = ShelterAgent(args.config)
     agent.run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
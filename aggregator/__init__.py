@@ -0,0 +1 @@
+"""Aggregator package"""
@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""
+Edge aggregator - Python 2/3 compatible
+
+Accepts the regular agent API (/agent/register, /agent/heartbeat,
+/metrics, /services) from agents on the local network, acknowledges
+them immediately and forwards them upstream as merged, gzip-compressed
+batches over a small pool of keep-alive connections. Each agent is
+pinned to one connection so that its requests stay in order. Batches are
+buffered in memory while the upstream link is down.
+
+Upstream batch request (POST server.url + batch_path, gzip body):
+
+    {"aggregator_id": "...",
+     "items": [{"path": "/metrics", "token": "<agent token>", "body": {...}}]}
+
+The upstream may answer {"success": true, "results": [{"success": ...,
+"status": ...}]} with one result per item. Registrations are acknowledged
+before the upstream sees them; agents whose registration is refused or
+whose items come back with status 401 get a 401 on their next heartbeat,
+which makes the agent register again with a new token.
+"""
+from __future__ import absolute_import
+from __future__ import division
+import json
+import logging
+import ssl
+import sys
+import threading
+import time
+import zlib
+from collections import deque, OrderedDict
+
+from outputs.connection import Connection, HTTPError, RETRY_STATUSES
+
+if sys.version_info[0] >= 3:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+else:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = ('/agent/register', '/agent/heartbeat', '/metrics', '/services')
+
+
+def gzip_compress(data, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class _Shard(object):
+    """Pending items and sealed batches of the agents sent over one connection."""
+
+    def __init__(self):
+        self.pending = OrderedDict()  # (agent_id, path, token) -> item
+        self.pending_since = None
+        self.batches = deque()        # (compressed_body, items)
+        self.failures = 0
+        self.retry_at = 0
+
+
+class UpstreamBatcher(object):
+    """
+    Merges agent payloads into compressed batches and ships them upstream.
+
+    Every agent is pinned to one connection, which sends its batches one
+    at a time, so each agent's requests reach the upstream in order (a
+    re-registration before the items signed with the new token).
+    """
+
+    def __init__(self, url, aggregator_id, batch_path='/agent/batch', api_token='',
+                 verify_ssl=True, connections=2, max_items=500, flush_interval=1.0,
+                 buffer_mb=64, timeout=30, max_backoff=60):
+        self.url = url
+        self.aggregator_id = aggregator_id
+        self.batch_path = batch_path
+        self.api_token = api_token
+        self.verify_ssl = verify_ssl
+        self.max_items = max_items
+        self.flush_interval = flush_interval
+        self.buffer_size = int(buffer_mb * 1024 * 1024)
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+
+        self.lock = threading.Condition()
+        self.shards = [_Shard() for _ in range(max(1, connections))]
+        self.buffered = 0
+        self.rejected = set()         # (agent_id, token) refused upstream
+
+        self.healthy = True
+        self.closing = False
+        self.deadline = None
+
+        self.stats = {
+            'received': 0,
+            'merged': 0,
+            'upstream_requests': 0,
+            'upstream_items': 0,
+            'upstream_bytes': 0,
+            'uncompressed_bytes': 0,
+            'dropped_items': 0,
+            'failures': 0,
+        }
+
+        self.threads = [threading.Thread(target=self._flush_loop, name='aggregator-flush')]
+        for i, shard in enumerate(self.shards):
+            self.threads.append(threading.Thread(target=self._send_loop, args=(shard,),
+                                                 name='aggregator-send-%d' % i))
+        for thread in self.threads:
+            thread.daemon = True
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def _shard(self, agent_id):
+        key = (u'%s' % agent_id).encode('utf-8')
+        return self.shards[(zlib.crc32(key) & 0xffffffff) % len(self.shards)]
+
+    def add(self, path, token, data):
+        """Queue one agent request, merging it with a pending one if possible."""
+        agent_id = data.get('agent_id')
+        key = (agent_id, path, token)
+        shard = self._shard(agent_id)
+
+        with self.lock:
+            self.stats['received'] += 1
+            if path == '/agent/register':
+                self.rejected = set(r for r in self.rejected if r[0] != agent_id)
+
+            item = shard.pending.get(key)
+            if item is not None and path == '/metrics':
+                item['body']['metrics'].extend(data.get('metrics') or [])
+                self.stats['merged'] += 1
+            elif item is not None and path != '/agent/register':
+                # Heartbeats and service lists: the newest snapshot wins
+                item['body'] = data
+                self.stats['merged'] += 1
+            else:
+                if path == '/metrics':
+                    data = dict(data, metrics=list(data.get('metrics') or []))
+                shard.pending[key] = {'path': path, 'token': token, 'body': data}
+                if shard.pending_since is None:
+                    shard.pending_since = time.time()
+
+            if len(shard.pending) >= self.max_items:
+                self._seal(shard)
+
+    def is_rejected(self, agent_id, token):
+        with self.lock:
+            return (agent_id, token) in self.rejected
+
+    def buffered_batches(self):
+        with self.lock:
+            return sum(len(shard.batches) for shard in self.shards)
+
+    def _seal(self, shard):
+        """Turn a shard's pending items into a compressed batch (lock held)."""
+        if not shard.pending:
+            return
+        items = list(shard.pending.values())
+        shard.pending = OrderedDict()
+        shard.pending_since = None
+
+        raw = json.dumps({'aggregator_id': self.aggregator_id, 'items': items}).encode('utf-8')
+        body = gzip_compress(raw)
+        self.stats['uncompressed_bytes'] += len(raw)
+
+        shard.batches.append((body, items))
+        self.buffered += len(body)
+        while self.buffered > self.buffer_size and len(shard.batches) > 1:
+            dropped_body, dropped_items = shard.batches.popleft()
+            self.buffered -= len(dropped_body)
+            self.stats['dropped_items'] += len(dropped_items)
+            logger.warning("Upstream buffer full, dropped batch of %d items" % len(dropped_items))
+        self.lock.notify_all()
+
+    def _flush_loop(self):
+        with self.lock:
+            while not self.closing:
+                now = time.time()
+                for shard in self.shards:
+                    if shard.pending_since is not None and now - shard.pending_since >= self.flush_interval:
+                        self._seal(shard)
+                self.lock.wait(self.flush_interval / 4.0)
+
+    def _send_loop(self, shard):
+        connection = Connection(self.url, self.verify_ssl, self.timeout)
+        headers = {'Content-Encoding': 'gzip'}
+        if self.api_token:
+            headers['Authorization'] = 'Bearer %s' % self.api_token
+
+        while True:
+            with self.lock:
+                while True:
+                    now = time.time()
+                    if self.closing and (not shard.batches or now >= self.deadline or now < shard.retry_at):
+                        connection.close()
+                        return
+                    if shard.batches and now >= shard.retry_at:
+                        break
+                    self.lock.wait(max(0.05, shard.retry_at - now) if shard.batches else 0.5)
+                body, items = shard.batches.popleft()
+                self.buffered -= len(body)
+
+            try:
+                response = connection.post(self.batch_path, body, headers)
+            except HTTPError as e:
+                if e.status >= 500 or e.status in RETRY_STATUSES:
+                    self._failed(shard, body, items, e)
+                else:
+                    logger.error("Upstream rejected batch of %d items: %s" % (len(items), str(e)))
+                    with self.lock:
+                        self.stats['dropped_items'] += len(items)
+                continue
+            except Exception as e:
+                self._failed(shard, body, items, e)
+                continue
+
+            with self.lock:
+                self.stats['upstream_requests'] += 1
+                self.stats['upstream_items'] += len(items)
+                self.stats['upstream_bytes'] += len(body)
+                shard.failures = 0
+                shard.retry_at = 0
+                if not self.healthy:
+                    self.healthy = True
+                    logger.info("Upstream recovered, %d batches buffered"
+                                % sum(len(s.batches) for s in self.shards))
+
+                results = response.get('results') if isinstance(response, dict) else None
+                for item, item_result in zip(items, results or []):
+                    if not isinstance(item_result, dict):
+                        continue
+                    agent_id = item['body'].get('agent_id')
+                    if item['path'] == '/agent/register':
+                        # Registrations carry the new token in the body
+                        if item_result.get('success') is False or item_result.get('status') == 401:
+                            self.rejected.add((agent_id, item['body'].get('api_token')))
+                    elif item_result.get('status') == 401:
+                        self.rejected.add((agent_id, item['token']))
+
+    def _failed(self, shard, body, items, error):
+        with self.lock:
+            # Put the batch back at the front; the shard has a single sender,
+            # so its batches still go out in order
+            shard.batches.appendleft((body, items))
+            self.buffered += len(body)
+            shard.failures += 1
+            self.stats['failures'] += 1
+            shard.retry_at = time.time() + min(self.max_backoff, 2 ** (shard.failures - 1))
+            if self.healthy:
+                self.healthy = False
+                logger.warning("Upstream unavailable, buffering batches: %s" % str(error))
+
+    def close(self, timeout=10):
+        """Seal pending items and give senders up to timeout seconds to drain."""
+        with self.lock:
+            for shard in self.shards:
+                self._seal(shard)
+            self.closing = True
+            self.deadline = time.time() + timeout
+            self.lock.notify_all()
+        for thread in self.threads:
+            thread.join(max(0, self.deadline - time.time()))
+        with self.lock:
+            undelivered = sum(len(items) for shard in self.shards for _, items in shard.batches)
+        if undelivered:
+            logger.warning("%d items not delivered upstream" % undelivered)
+
+
+class AggregatorHandler(BaseHTTPRequestHandler):
+    """Agent-facing endpoint; answers as soon as the request is queued."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # Idle keep-alive clients and stalled handshakes must not hold a
+        # thread forever
+        self.timeout = self.server.client_timeout
+        BaseHTTPRequestHandler.setup(self)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0 or length > self.server.max_body:
+            # The unread body is still on the socket, so this connection is done
+            self.close_connection = True
+            if length < 0:
+                return self._reply(400, {'success': False, 'message': 'Invalid Content-Length'})
+            return self._reply(413, {'success': False, 'message': 'Request body too large'})
+        body = self.rfile.read(length)
+
+        endpoint = None
+        for candidate in ENDPOINTS:
+            if self.path.rstrip('/').endswith(candidate):
+                endpoint = candidate
+                break
+        if endpoint is None:
+            return self._reply(404, {'success': False, 'message': 'Unknown endpoint'})
+
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or not data.get('agent_id'):
+            return self._reply(400, {'success': False, 'message': 'Invalid payload'})
+
+        token = None
+        auth = self.headers.get('Authorization', '')
+        if auth.startswith('Bearer '):
+            token = auth[7:]
+        elif endpoint != '/agent/register':
+            return self._reply(401, {'success': False, 'message': 'Missing token'})
+
+        batcher = self.server.batcher
+        if endpoint == '/agent/heartbeat' and batcher.is_rejected(data['agent_id'], token):
+            return self._reply(401, {'success': False, 'message': 'Token rejected upstream'})
+
+        batcher.add(endpoint, token, data)
+        self._reply(200, {'success': True, 'message': 'Queued'})
+
+    def _reply(self, status, data):
+        out = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s" % (self.address_string(), format % args))
+
+
+def server_context():
+    """TLS server context; PROTOCOL_TLS_SERVER only exists on Python 3.6+."""
+    protocol = getattr(ssl, 'PROTOCOL_TLS_SERVER', None)
+    if protocol is not None:
+        return ssl.SSLContext(protocol)
+    context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+    return context
+
+
+class AggregatorServer(ThreadingMixIn, HTTPServer):
+    """HTTPS listener for local agents."""
+    daemon_threads = True
+    # Hundreds of agents may connect at once; the default backlog of 5
+    # turns bursts into 1s SYN retransmits
+    request_queue_size = 1024
+
+    def __init__(self, address, batcher, certfile, keyfile, max_body_mb=4, client_timeout=30):
+        HTTPServer.__init__(self, address, AggregatorHandler)
+        context = server_context()
+        context.load_cert_chain(certfile, keyfile)
+        # Handshake in the handler thread, not in the accept loop
+        self.socket = context.wrap_socket(self.socket, server_side=True,
+                                          do_handshake_on_connect=False)
+        self.batcher = batcher
+        self.max_body = int(max_body_mb * 1024 * 1024)
+        self.client_timeout = client_timeout
+
+    def handle_error(self, request, client_address):
+        # Failed handshakes and dropped agents are routine; keep them out of the log
+        logger.debug("Error serving %s" % (client_address,), exc_info=True)
+
+
+def parse_listen(listen):
+    host, _, port = str(listen).rpartition(':')
+    return (host or '0.0.0.0', int(port))
+
+
+def create_aggregator(config, aggregator_id):
+    """Build (server, batcher) from the server and aggregator config sections."""
+    server_config = config.get('server') or {}
+    settings = config.get('aggregator') or {}
+
+    batcher = UpstreamBatcher(
+        server_config['url'].rstrip('/'),
+        aggregator_id,
+        batch_path=settings.get('batch_path', '/agent/batch'),
+        api_token=settings.get('api_token') or (config.get('agent') or {}).get('api_token', ''),
+        verify_ssl=server_config.get('verify_ssl', True),
+        connections=settings.get('connections', 2),
+        max_items=settings.get('max_batch_items', 500),
+        flush_interval=settings.get('flush_interval', 1.0),
+        buffer_mb=settings.get('buffer_mb', 64)
+    )
+    server = AggregatorServer(
+        parse_listen(settings.get('listen', '0.0.0.0:8443')),
+        batcher,
+        settings['certfile'],
+        settings['keyfile'],
+        max_body_mb=settings.get('max_body_mb', 4),
+        client_timeout=settings.get('client_timeout', 30)
+    )
+    return server, batcher
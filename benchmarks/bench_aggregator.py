@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Aggregator load test with simulated agents
+
+Runs an aggregator between many simulated agents and an HTTPS upstream
+stub on 127.0.0.1 and reports how many upstream requests, TLS
+connections and bytes the agents' traffic turned into. It also checks
+that every metric arrived. The outage scenario fails the upstream for
+a while and verifies that buffered batches are delivered afterwards.
+
+Usage: python -m benchmarks.bench_aggregator [--agents 500] [--cycles 6] [--quick]
+"""
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import json
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+
+from aggregator.proxy import AggregatorServer, UpstreamBatcher
+from outputs.connection import Connection
+from benchmarks.bench_upload import StubHandler, StubServer, make_certificate, metrics_payload, services_payload
+from benchmarks.common import percentile, result
+
+SUITE = 'aggregator'
+
+
+class UpstreamHandler(StubHandler):
+    """Batch endpoint that counts what reaches the upstream."""
+
+    def setup(self):
+        StubHandler.setup(self)
+        with self.server.lock:
+            self.server.stats['connections'] += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        stats = self.server.stats
+        with self.server.lock:
+            stats['requests'] += 1
+            failing = self.server.failing
+        if failing:
+            return self._reply(503, {'success': False, 'message': 'Unavailable'})
+
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 31)
+        items = json.loads(body.decode('utf-8'))['items']
+        with self.server.lock:
+            stats['delivered_requests'] += 1
+            stats['bytes'] += int(self.headers.get('Content-Length', 0))
+            for item in items:
+                stats['items'] += 1
+                if item['path'] == '/metrics':
+                    stats['metrics'] += len(item['body']['metrics'])
+        self._reply(200, {'success': True, 'results': [{'success': True}] * len(items)})
+
+    def _reply(self, status, data):
+        out = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+
+def start_upstream(cert):
+    server = StubServer(cert[0], cert[1], handler=UpstreamHandler)
+    server.lock = threading.Lock()
+    server.failing = False
+    server.stats = dict.fromkeys(['connections', 'requests', 'delivered_requests',
+                                  'bytes', 'items', 'metrics'], 0)
+    server.start()
+    return server
+
+
+def simulate_agents(url, agents, cycles, workers=16, services_every=3):
+    """Drive agents through register + cycles of heartbeat/metrics/services."""
+    totals = {'requests': 0, 'bytes': 0, 'metrics': 0, 'errors': 0}
+    latencies = []
+    lock = threading.Lock()
+    metrics = metrics_payload(5)
+    services = services_payload(50)
+
+    def worker(agent_ids):
+        connections = dict((a, Connection(url, verify_ssl=False)) for a in agent_ids)
+        local = {'requests': 0, 'bytes': 0, 'metrics': 0, 'errors': 0}
+        local_latencies = []
+
+        def send(agent_id, path, data, token=True):
+            body = json.dumps(data).encode('utf-8')
+            headers = {'Authorization': 'Bearer token-%s' % agent_id} if token else {}
+            t0 = time.time()
+            try:
+                connections[agent_id].post(path, body, headers)
+            except Exception:
+                local['errors'] += 1
+            local_latencies.append(time.time() - t0)
+            local['requests'] += 1
+            local['bytes'] += len(body)
+
+        for agent_id in agent_ids:
+            send(agent_id, '/agent/register',
+                 {'agent_id': agent_id, 'hostname': agent_id, 'api_token': 'token-%s' % agent_id}, False)
+        for cycle in range(cycles):
+            for agent_id in agent_ids:
+                send(agent_id, '/agent/heartbeat', {'agent_id': agent_id})
+                send(agent_id, '/metrics', {'agent_id': agent_id, 'metrics': metrics})
+                local['metrics'] += len(metrics)
+                if cycle % services_every == 0:
+                    send(agent_id, '/services', {'agent_id': agent_id, 'services': services})
+
+        for connection in connections.values():
+            connection.close()
+        with lock:
+            for key in totals:
+                totals[key] += local[key]
+            latencies.extend(local_latencies)
+
+    ids = ['sim-%04d' % i for i in range(agents)]
+    threads = [threading.Thread(target=worker, args=(ids[i::workers],)) for i in range(workers)]
+    t0 = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    totals['elapsed_s'] = time.time() - t0
+    totals['p50_ms'] = percentile(latencies, 50) * 1000.0
+    totals['p99_ms'] = percentile(latencies, 99) * 1000.0
+    return totals
+
+
+def wait_for(condition, timeout):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def run_scenario(cert, agents, cycles, outage=0):
+    upstream = start_upstream(cert)
+    batcher = UpstreamBatcher(upstream.url, 'bench-aggregator', verify_ssl=False,
+                              connections=2, flush_interval=0.2, max_backoff=1)
+    batcher.start()
+    server = AggregatorServer(('127.0.0.1', 0), batcher, cert[0], cert[1])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'https://127.0.0.1:%d/api' % server.server_address[1]
+
+    if outage:
+        upstream.failing = True
+    agents_totals = simulate_agents(url, agents, cycles)
+    if outage:
+        time.sleep(outage)
+        buffered = batcher.buffered_batches()
+        upstream.failing = False
+
+    delivered = wait_for(lambda: upstream.stats['metrics'] >= agents_totals['metrics'], 60)
+
+    server.shutdown()
+    server.server_close()
+    batcher.close(5)
+    upstream.shutdown()
+
+    stats = upstream.stats
+    metrics = {
+        'agent_requests': agents_totals['requests'],
+        'agent_bytes': agents_totals['bytes'],
+        'agent_errors': agents_totals['errors'],
+        'agent_p50_ms': agents_totals['p50_ms'],
+        'agent_p99_ms': agents_totals['p99_ms'],
+        'upstream_requests': stats['delivered_requests'],
+        'upstream_attempts': stats['requests'],
+        'upstream_connections': stats['connections'],
+        'upstream_bytes': stats['bytes'],
+        'upstream_items': stats['items'],
+        'merged_requests': batcher.stats['merged'],
+        'request_reduction': agents_totals['requests'] / max(1, stats['delivered_requests']),
+        'byte_reduction': agents_totals['bytes'] / max(1, stats['bytes']),
+        'metrics_sent': agents_totals['metrics'],
+        'metrics_delivered': stats['metrics'],
+        'complete': bool(delivered and stats['metrics'] == agents_totals['metrics']),
+    }
+    if outage:
+        metrics['buffered_batches'] = buffered
+    return metrics
+
+
+def run(quick=False, agents=None, cycles=None):
+    agents = agents or (50 if quick else 500)
+    cycles = cycles or (3 if quick else 6)
+
+    workdir = tempfile.mkdtemp(prefix='shelter-aggregator-')
+    try:
+        cert = make_certificate(workdir)
+        if cert is None:
+            return [result(SUITE, 'skipped', {}, {'reason': 'openssl not available'})]
+
+        params = {'agents': agents, 'cycles': cycles}
+        return [
+            result(SUITE, 'steady', params, run_scenario(cert, agents, cycles)),
+            result(SUITE, 'outage', dict(params, outage_s=2), run_scenario(cert, agents, cycles, outage=2)),
+        ]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregator load test with simulated agents')
+    parser.add_argument('--agents', type=int, help='Number of simulated agents (default 500)')
+    parser.add_argument('--cycles', type=int, help='Collection cycles per agent (default 6)')
+    parser.add_argument('--quick', action='store_true', help='50 agents, 3 cycles')
+    args = parser.parse_args()
+    print(json.dumps(run(args.quick, args.agents, args.cycles), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-collector microbenchmarks
+
+Times each collector's collect() against a synthetic host (default) or
+the real psutil of this machine (--real-psutil). Note that CPUCollector
+samples over interval=1, so with real psutil it costs at least 1s.
+
+Usage: python -m benchmarks.bench_collectors [--quick] [--real-psutil]
+"""
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import json
+
+from benchmarks import fake_psutil
+from benchmarks.common import measure, result
+
+SUITE = 'collectors'
+
+
+def load_collectors(real=False, processes=1000, mounts=10):
+    if real:
+        fake_psutil.restore()
+    else:
+        fake_psutil.install(fake_psutil.create(processes, mounts))
+    from collectors.cpu import CPUCollector
+    from collectors.memory import MemoryCollector
+    from collectors.disk import DiskCollector
+    from collectors.network import NetworkCollector
+    from collectors.services import ServiceCollector
+    return [
+        ('cpu', CPUCollector()),
+        ('memory', MemoryCollector()),
+        ('disk', DiskCollector()),
+        ('network', NetworkCollector()),
+        ('services', ServiceCollector()),
+    ]
+
+
+def run(quick=False, real=False):
+    processes, mounts = 1000, 10
+    params = {'psutil': 'real' if real else 'fake'}
+    if not real:
+        params.update({'processes': processes, 'mounts': mounts})
+
+    results = []
+    for name, collector in load_collectors(real, processes, mounts):
+        if real and name == 'cpu':
+            repeat = 2
+        else:
+            repeat = 20 if quick else 200
+        stats = measure(collector.collect, repeat=repeat, warmup=1)
+        results.append(result(SUITE, name, params, stats))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-collector microbenchmarks')
+    parser.add_argument('--quick', action='store_true', help='Fewer iterations')
+    parser.add_argument('--real-psutil', action='store_true', help='Measure this host instead of a synthetic one')
+    args = parser.parse_args()
+    print(json.dumps(run(args.quick, args.real_psutil), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
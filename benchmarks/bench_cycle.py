@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Full collection-cycle benchmark on synthetic hosts
+
+Builds a real ShelterAgent against a fake psutil sized from 100 to 50k
+processes and 1 to 500 mounts, then times one metrics cycle
+(collect_metrics, local store append, payload serialisation) and one
+services cycle (ServiceCollector.collect and serialisation). NIC count
+is not a parameter: NetworkCollector only reads the system-wide counters.
+
+Usage: python -m benchmarks.bench_cycle [--quick]
+"""
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+
+from benchmarks import fake_psutil
+from benchmarks.common import measure, result
+
+SUITE = 'cycle'
+
+# (processes, mounts)
+SCALES = [
+    (100, 1),
+    (1000, 10),
+    (10000, 100),
+    (50000, 500),
+]
+QUICK_SCALES = SCALES[:2]
+
+
+def make_agent(workdir, server_url='https://127.0.0.1:1/api', extra=None):
+    """Create a ShelterAgent with a throwaway config inside workdir."""
+    config = {
+        'server': {'url': server_url, 'verify_ssl': False},
+        'agent': {'hwid': 'benchhwid0000000', 'hostname': 'bench', 'api_token': 'bench-token'},
+        'storage': {'enabled': True, 'path': os.path.join(workdir, 'data')},
+        # stdout carries the benchmark results
+        'logging': {'level': 'WARNING', 'file': os.path.join(workdir, 'agent.log'), 'console': False},
+    }
+    config.update(extra or {})
+    config_file = os.path.join(workdir, 'config.yml')
+    with open(config_file, 'w') as f:
+        yaml.dump(config, f, default_flow_style=False)
+
+    from agent import ShelterAgent
+    return ShelterAgent(config_file)
+
+
+def run(quick=False):
+    results = []
+    for processes, mounts in (QUICK_SCALES if quick else SCALES):
+        fake_psutil.install(fake_psutil.create(processes, mounts))
+        workdir = tempfile.mkdtemp(prefix='shelter-cycle-')
+        try:
+            agent = make_agent(workdir)
+            # Cycles take microseconds; wall-clock stamps would mostly be
+            # rejected by the store as out of order
+            clock = [time.time()]
+
+            def metrics_cycle():
+                metrics = agent.collect_metrics()
+                clock[0] += 1
+                agent.store_metrics(metrics, clock[0])
+                json.dumps({'agent_id': agent.agent_id, 'metrics': metrics})
+
+            def services_cycle():
+                services = agent.service_collector.collect()
+                json.dumps({'agent_id': agent.agent_id, 'services': services})
+
+            params = {'processes': processes, 'mounts': mounts}
+            repeat = 5 if processes >= 10000 else 30
+            if quick:
+                repeat = max(3, repeat // 3)
+            results.append(result(SUITE, 'metrics', params, measure(metrics_cycle, repeat=repeat)))
+            results.append(result(SUITE, 'services', params, measure(services_cycle, repeat=repeat, warmup=1)))
+
+            if agent.local_store is not None:
+                agent.local_store.close()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Full-cycle benchmark on synthetic hosts')
+    parser.add_argument('--quick', action='store_true', help='Small hosts only')
+    args = parser.parse_args()
+    print(json.dumps(run(args.quick), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
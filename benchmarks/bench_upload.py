@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Upload throughput and latency against a local HTTPS stub server
+
+Starts a TLS server on 127.0.0.1 with a throwaway self-signed certificate
+(requires the openssl command) and measures:
+- ShelterAgent.http_post: one TLS connection per request
+- outputs.connection.Connection: keep-alive connection
+- outputs.fanout.FanOut: end-to-end delivery to several targets
+
+Usage: python -m benchmarks.bench_upload [--quick] [--delay-ms 0]
+"""
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from aggregator.proxy import server_context
+from benchmarks import fake_psutil
+from benchmarks.bench_cycle import make_agent
+from benchmarks.common import measure, result
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+SUITE = 'upload'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, Nagle plus
+    # delayed ACK adds ~40ms to every keep-alive response
+    disable_nagle_algorithm = True
+    response_body = b'{"success": true, "message": "ok"}'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.response_body)))
+        self.end_headers()
+        self.wfile.write(self.response_body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """HTTPS server that accepts any POST and answers success."""
+    daemon_threads = True
+
+    def __init__(self, certfile, keyfile, delay=0, handler=StubHandler):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        context = server_context()
+        context.load_cert_chain(certfile, keyfile)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.delay = delay
+
+    @property
+    def url(self):
+        return 'https://127.0.0.1:%d/api' % self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+def make_certificate(workdir):
+    """Create a self-signed certificate, or return None without openssl."""
+    certfile = os.path.join(workdir, 'cert.pem')
+    keyfile = os.path.join(workdir, 'key.pem')
+    try:
+        subprocess.check_call(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+             '-keyout', keyfile, '-out', certfile, '-days', '1',
+             '-subj', '/CN=127.0.0.1'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return certfile, keyfile
+
+
+def metrics_payload(count):
+    types = [('cpu', '%'), ('memory', '%'), ('disk', '%'), ('network', 'Mbps'), ('io', 'MB/s')]
+    return [{'metric_type': types[i % 5][0], 'value': round(i * 1.37 % 100, 2), 'unit': types[i % 5][1]}
+            for i in range(count)]
+
+
+def services_payload(count):
+    return [{
+        'name': 'proc-%d' % i, 'pid': 1000 + i, 'status': 'running',
+        'cpu_percent': 1.5, 'memory_percent': 0.8, 'memory_mb': 120.5,
+        'disk_read_mb': 10.0, 'disk_write_mb': 2.0, 'user': 'root',
+        'command': '/usr/bin/proc-%d --worker' % i,
+    } for i in range(count)]
+
+
+def throughput(stats, payload_bytes):
+    per_s = 1000.0 / stats['mean_ms'] if stats['mean_ms'] else 0
+    stats['requests_per_s'] = per_s
+    stats['mb_per_s'] = per_s * payload_bytes / 1048576.0
+    stats['payload_bytes'] = payload_bytes
+    return stats
+
+
+def run_fanout(urls, batches, batch_size):
+    """Publish batches to every url and time until all are delivered."""
+    from outputs.fanout import FanOut, Target
+
+    targets = [Target('t%d' % i, url, 'bench-token', verify_ssl=False) for i, url in enumerate(urls)]
+    fanout = FanOut('bench-agent', targets)
+    payload = metrics_payload(batch_size)
+
+    t0 = time.time()
+    for _ in range(batches):
+        fanout.publish_metrics(payload)
+    publish_s = time.time() - t0
+
+    expected = batches * batch_size
+    while any(t.sent < expected for t in targets) and time.time() - t0 < 120:
+        time.sleep(0.005)
+    elapsed = time.time() - t0
+    delivered = sum(t.sent for t in targets)
+    fanout.close(1)
+
+    return {
+        'publish_ms': publish_s * 1000.0,
+        'delivery_s': elapsed,
+        'metrics_per_s': delivered / elapsed if elapsed else 0,
+        'delivered_metrics': delivered,
+    }
+
+
+def run(quick=False, delay=0):
+    from outputs.connection import Connection
+
+    workdir = tempfile.mkdtemp(prefix='shelter-upload-')
+    results = []
+    try:
+        cert = make_certificate(workdir)
+        if cert is None:
+            return [result(SUITE, 'skipped', {}, {'reason': 'openssl not available'})]
+
+        server = StubServer(cert[0], cert[1], delay)
+        server.start()
+
+        fake_psutil.install(fake_psutil.create())
+        agent = make_agent(workdir, server.url)
+        connection = Connection(server.url, verify_ssl=False)
+
+        repeat = 20 if quick else 200
+        payloads = [
+            ('metrics', '/metrics', {'agent_id': agent.agent_id, 'metrics': metrics_payload(30)}),
+            ('metrics', '/metrics', {'agent_id': agent.agent_id, 'metrics': metrics_payload(600)}),
+            ('services', '/services', {'agent_id': agent.agent_id, 'services': services_payload(50)}),
+        ]
+        for kind, path, data in payloads:
+            items = len(data[kind])
+            body = json.dumps(data).encode('utf-8')
+            params = {'payload': kind, 'items': items, 'delay_ms': delay * 1000}
+
+            stats = measure(lambda: agent.http_post(server.url + path, data), repeat=repeat)
+            results.append(result(SUITE, 'http_post', params, throughput(stats, len(body))))
+
+            stats = measure(lambda: connection.post(path, body), repeat=repeat)
+            results.append(result(SUITE, 'keepalive', params, throughput(stats, len(body))))
+
+        connection.close()
+
+        batches = 50 if quick else 500
+        for count in (1, 3):
+            servers = [server]
+            for _ in range(count - 1):
+                extra = StubServer(cert[0], cert[1], delay)
+                extra.start()
+                servers.append(extra)
+            stats = run_fanout([s.url for s in servers], batches, 30)
+            params = {'targets': count, 'batches': batches, 'batch_size': 30, 'delay_ms': delay * 1000}
+            results.append(result(SUITE, 'fanout', params, stats))
+            for extra in servers[1:]:
+                extra.shutdown()
+
+        server.shutdown()
+        if agent.local_store is not None:
+            agent.local_store.close()
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTPS upload benchmark')
+    parser.add_argument('--quick', action='store_true', help='Fewer iterations')
+    parser.add_argument('--delay-ms', type=float, default=0, help='Simulated server processing time')
+    args = parser.parse_args()
+    print(json.dumps(run(args.quick, args.delay_ms / 1000.0), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Shared timing and result helpers for the benchmark suite"""
+from __future__ import division
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(samples_s):
+    """Latency statistics in milliseconds for a list of durations in seconds."""
+    ms = [s * 1000.0 for s in samples_s]
+    return {
+        'runs': len(ms),
+        'min_ms': min(ms),
+        'mean_ms': sum(ms) / len(ms),
+        'p50_ms': percentile(ms, 50),
+        'p95_ms': percentile(ms, 95),
+        'p99_ms': percentile(ms, 99),
+        'max_ms': max(ms),
+    }
+
+
+def measure(func, repeat=20, warmup=2, min_time=None):
+    """Call func repeatedly and summarise its wall time per call."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    started = time.time()
+    while len(samples) < repeat or (min_time and time.time() - started < min_time):
+        t0 = time.time()
+        func()
+        samples.append(time.time() - t0)
+    return summarize(samples)
+
+
+def git_revision():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                      stderr=subprocess.STDOUT)
+        return out.decode('utf-8').strip()
+    except Exception:
+        return None
+
+
+def environment():
+    return {
+        'commit': git_revision(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count() if hasattr(os, 'cpu_count') else None,
+    }
+
+
+def result(suite, name, params, metrics):
+    """One machine-readable benchmark result."""
+    return {'suite': suite, 'name': name, 'params': params, 'metrics': metrics}
+
+
+def result_key(entry):
+    """Stable identity of a result across runs, used for comparison."""
+    params = ','.join('%s=%s' % (k, entry['params'][k]) for k in sorted(entry['params']))
+    return '%s/%s[%s]' % (entry['suite'], entry['name'], params)
+
+
+def write_results(path, results):
+    report = {'environment': environment(), 'results': results}
+    if path == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return report
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare two benchmark result files
+
+Prints the relative change of every metric present in both runs and
+exits with status 1 when a metric regresses by more than --threshold
+percent. Metrics ending in _per_s and the aggregator reduction ratios
+are higher-is-better; all other timing and size metrics are
+lower-is-better.
+
+Usage: python -m benchmarks.compare BASE.json NEW.json [--threshold 10]
+"""
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import json
+import sys
+
+from benchmarks.common import result_key
+
+# Metrics compared by default; counters like 'runs' are not
+DEFAULT_METRICS = ('p50_ms', 'p95_ms', 'mean_ms', 'requests_per_s', 'metrics_per_s',
+                   'write_us_per_sample', 'bytes_per_sample', 'scan_raw_s', 'agg_avg_s',
+                   'delivery_s', 'upstream_requests', 'request_reduction', 'byte_reduction')
+
+HIGHER_IS_BETTER = ('request_reduction', 'byte_reduction')
+
+
+def load(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report.get('environment', {}), dict((result_key(r), r['metrics']) for r in report['results'])
+
+
+def change(name, old, new):
+    """Percent change where positive means worse."""
+    if not old:
+        return 0.0
+    delta = (new - old) / abs(old) * 100.0
+    return -delta if name.endswith('_per_s') or name in HIGHER_IS_BETTER else delta
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Regression threshold in percent (default 10)')
+    parser.add_argument('--metric', action='append', help='Metric to compare (repeatable)')
+    args = parser.parse_args()
+
+    base_env, base = load(args.base)
+    new_env, new = load(args.new)
+    metrics = args.metric or DEFAULT_METRICS
+
+    print("base: %s  new: %s" % ((base_env.get('commit') or '?')[:10], (new_env.get('commit') or '?')[:10]))
+    regressions = 0
+    for key in sorted(set(base) & set(new)):
+        for name in metrics:
+            old_value = base[key].get(name)
+            new_value = new[key].get(name)
+            if not isinstance(old_value, (int, float)) or not isinstance(new_value, (int, float)):
+                continue
+            worse = change(name, old_value, new_value)
+            flag = ''
+            if worse > args.threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print("%-64s %-20s %12.4g -> %12.4g  %+7.1f%%%s"
+                  % (key, name, old_value, new_value, worse, flag))
+
+    for key in sorted(set(base) ^ set(new)):
+        print("%-64s only in %s" % (key, 'base' if key in base else 'new'))
+
+    if regressions:
+        print("%d regression(s) above %.1f%%" % (regressions, args.threshold))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
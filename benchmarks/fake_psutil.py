@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic psutil replacement for benchmarks
+
+Simulates a host with a given number of processes, mounts and NICs. The
+fake returns precomputed data, so timings measure the agent's own work
+rather than the kernel's.
+"""
+from __future__ import division
+import sys
+import types
+from collections import namedtuple
+
+STATUS_RUNNING = 'running'
+STATUS_SLEEPING = 'sleeping'
+
+svmem = namedtuple('svmem', 'total available percent used free')
+sswap = namedtuple('sswap', 'total used free percent sin sout')
+sdiskpart = namedtuple('sdiskpart', 'device mountpoint fstype opts')
+sdiskusage = namedtuple('sdiskusage', 'total used free percent')
+sdiskio = namedtuple('sdiskio', 'read_count write_count read_bytes write_bytes read_time write_time')
+snetio = namedtuple('snetio', 'bytes_sent bytes_recv packets_sent packets_recv errin errout dropin dropout')
+pmem = namedtuple('pmem', 'rss vms')
+pio = namedtuple('pio', 'read_count write_count read_bytes write_bytes')
+
+
+class Error(Exception):
+    pass
+
+
+class NoSuchProcess(Error):
+    pass
+
+
+class AccessDenied(Error):
+    pass
+
+
+class ZombieProcess(NoSuchProcess):
+    pass
+
+
+class Process(object):
+    def __init__(self, pid, denied):
+        self.pid = pid
+        self.denied = denied
+        self.info = {
+            'pid': pid,
+            'name': 'proc-%d' % (pid % 997),
+            'username': 'root' if pid % 3 == 0 else 'www-data',
+            'cpu_percent': (pid * 7919 % 1000) / 10.0,
+            'memory_percent': (pid * 104729 % 1000) / 100.0,
+            'memory_info': pmem(rss=(pid % 512 + 1) * 1048576, vms=(pid % 512 + 1) * 4194304),
+            'cmdline': ['/usr/bin/proc-%d' % (pid % 997), '--worker', str(pid)],
+            'status': STATUS_RUNNING if pid % 5 else STATUS_SLEEPING,
+        }
+        self._io = pio(pid, pid * 2, pid * 4096, pid * 8192)
+
+    def io_counters(self):
+        if self.denied:
+            raise AccessDenied()
+        return self._io
+
+
+def create(processes=100, mounts=1, nics=1, cpus=4):
+    """Build a module object that can stand in for psutil."""
+    fake = types.ModuleType('psutil')
+    fake.__dict__.update({
+        'STATUS_RUNNING': STATUS_RUNNING,
+        'STATUS_SLEEPING': STATUS_SLEEPING,
+        'Error': Error,
+        'NoSuchProcess': NoSuchProcess,
+        'AccessDenied': AccessDenied,
+        'ZombieProcess': ZombieProcess,
+    })
+
+    # Every 10th process hides its I/O counters, as unprivileged agents see
+    procs = [Process(pid, pid % 10 == 0) for pid in range(1, processes + 1)]
+    partitions = [sdiskpart('/dev/sd%d' % i, '/mnt/vol%d' % i if i else '/', 'ext4', 'rw')
+                  for i in range(mounts)]
+    usage = sdiskusage(500 * 1024 ** 3, 200 * 1024 ** 3, 300 * 1024 ** 3, 40.0)
+    counters = {'io': 0, 'net': 0}
+
+    def cpu_percent(interval=None, percpu=False):
+        return [12.5] * cpus if percpu else 12.5
+
+    def disk_io_counters(perdisk=False):
+        counters['io'] += 1
+        n = counters['io'] * 1048576
+        return sdiskio(n, n, n * mounts, n * mounts, 0, 0)
+
+    def net_io_counters(pernic=False):
+        counters['net'] += 1
+        n = counters['net'] * 131072 * nics
+        stats = snetio(n, n, n // 1500, n // 1500, 0, 0, 0, 0)
+        if pernic:
+            return dict(('eth%d' % i, stats) for i in range(nics))
+        return stats
+
+    fake.__dict__.update({
+        'cpu_percent': cpu_percent,
+        'cpu_count': lambda logical=True: cpus,
+        'getloadavg': lambda: (0.5, 0.4, 0.3),
+        'virtual_memory': lambda: svmem(16 * 1024 ** 3, 8 * 1024 ** 3, 50.0, 8 * 1024 ** 3, 4 * 1024 ** 3),
+        'swap_memory': lambda: sswap(2 * 1024 ** 3, 0, 2 * 1024 ** 3, 0.0, 0, 0),
+        'disk_partitions': lambda all=False: list(partitions),
+        'disk_usage': lambda path: usage,
+        'disk_io_counters': disk_io_counters,
+        'net_io_counters': net_io_counters,
+        'process_iter': lambda attrs=None: iter(procs),
+    })
+    return fake
+
+
+COLLECTOR_MODULES = ('collectors.cpu', 'collectors.memory', 'collectors.disk',
+                     'collectors.network', 'collectors.services')
+
+_saved = {}
+
+
+def install(fake):
+    """Make fake the psutil seen by the collectors and the agent."""
+    if 'psutil' not in _saved:
+        _saved['psutil'] = sys.modules.get('psutil')
+    sys.modules['psutil'] = fake
+    for name in COLLECTOR_MODULES:
+        module = sys.modules.get(name)
+        if module is not None:
+            module.psutil = fake
+
+
+def restore():
+    """Undo install() so that later imports and collectors see the real psutil."""
+    if 'psutil' not in _saved:
+        return
+    original = _saved.pop('psutil')
+    if original is None:
+        sys.modules.pop('psutil', None)
+        # Modules bound to the fake are re-imported against the real psutil
+        for name in COLLECTOR_MODULES + ('agent',):
+            sys.modules.pop(name, None)
+        return
+    sys.modules['psutil'] = original
+    for name in COLLECTOR_MODULES:
+        module = sys.modules.get(name)
+        if module is not None:
+            module.psutil = original
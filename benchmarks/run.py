@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Run the benchmark suite and write machine-readable results
+
+Results are JSON with the git commit and environment, one entry per
+benchmark keyed by suite, name and parameters. Compare two runs with
+python -m benchmarks.compare.
+
+Usage: python -m benchmarks.run [--quick] [--suite cycle --suite upload] [-o FILE]
+"""
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import sys
+
+from benchmarks import bench_aggregator, bench_collectors, bench_cycle, bench_tsdb, bench_upload, fake_psutil
+from benchmarks.common import result, result_key, write_results
+from logconfig import shutdown_logging
+
+SUITES = ['collectors', 'cycle', 'upload', 'tsdb', 'aggregator']
+
+
+def run_tsdb(quick=False):
+    days = 1 if quick else 7
+    return [result('tsdb', 'week_1s' if days == 7 else 'day_1s', {'days': days, 'interval': 1},
+                   bench_tsdb.run(days, 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run ShelterAgent benchmarks')
+    parser.add_argument('--suite', action='append', choices=SUITES,
+                        help='Suite to run (repeatable, default: all)')
+    parser.add_argument('--quick', action='store_true', help='Smaller hosts and fewer iterations')
+    parser.add_argument('--real-psutil', action='store_true',
+                        help='Collector microbenchmarks against this host instead of a synthetic one')
+    parser.add_argument('--delay-ms', type=float, default=0, help='Simulated server time for the upload suite')
+    parser.add_argument('-o', '--output', default='benchmark-results.json',
+                        help="Results file ('-' for stdout)")
+    args = parser.parse_args()
+
+    runners = {
+        'collectors': lambda: bench_collectors.run(args.quick, args.real_psutil),
+        'cycle': lambda: bench_cycle.run(args.quick),
+        'upload': lambda: bench_upload.run(args.quick, args.delay_ms / 1000.0),
+        'tsdb': lambda: run_tsdb(args.quick),
+        'aggregator': lambda: bench_aggregator.run(args.quick),
+    }
+
+    results = []
+    for suite in args.suite or SUITES:
+        print("Running %s..." % suite, file=sys.stderr)
+        try:
+            entries = runners[suite]()
+        finally:
+            # Synthetic suites must not leak the fake psutil or the agent's
+            # logging (whose file lives in the suite's temp dir) into later ones
+            fake_psutil.restore()
+            shutdown_logging()
+        for entry in entries:
+            results.append(entry)
+            metrics = entry['metrics']
+            summary = metrics.get('p50_ms')
+            if summary is not None:
+                print("  %-60s p50 %.3f ms" % (result_key(entry), summary), file=sys.stderr)
+            else:
+                print("  %s" % result_key(entry), file=sys.stderr)
+
+    write_results(args.output, results)
+    if args.output != '-':
+        print("Results written to %s" % args.output, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -45,7 +45,11 @@ INSTALL_PKG="${PACKAGE_NAME}-${VERSION}-installer.tar.gz"
 
 tar -czf "$DIST_DIR/$INSTALL_PKG" \
     agent.py \
+    logconfig.py \
     collectors/ \
+    storage/ \
+    outputs/ \
+    aggregator/ \
     requirements.txt \
     .env.example \
     install.sh \
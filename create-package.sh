@@ -19,11 +19,15 @@ AGENT_DIR="$TMP_DIR/$PACKAGE_NAME"
 
 mkdir -p "$AGENT_DIR"
 mkdir -p "$AGENT_DIR/collectors"
+mkdir -p "$AGENT_DIR/storage"
+mkdir -p "$AGENT_DIR/outputs"
+mkdir -p "$AGENT_DIR/aggregator"
 
 echo "Copying agent files..."
 
 # Copy main agent files
 cp agent.py "$AGENT_DIR/"
+cp logconfig.py "$AGENT_DIR/"
 cp requirements.txt "$AGENT_DIR/"
 
 # Copy collectors
@@ -34,6 +38,19 @@ cp collectors/disk.py "$AGENT_DIR/collectors/"
 cp collectors/network.py "$AGENT_DIR/collectors/"
 cp collectors/services.py "$AGENT_DIR/collectors/"
 
+# Copy local storage
+cp storage/__init__.py "$AGENT_DIR/storage/"
+cp storage/tsdb.py "$AGENT_DIR/storage/"
+
+# Copy outputs
+cp outputs/__init__.py "$AGENT_DIR/outputs/"
+cp outputs/connection.py "$AGENT_DIR/outputs/"
+cp outputs/fanout.py "$AGENT_DIR/outputs/"
+
+# Copy aggregator
+cp aggregator/__init__.py "$AGENT_DIR/aggregator/"
+cp aggregator/proxy.py "$AGENT_DIR/aggregator/"
+
 # Create tarball
 echo "Creating tarball..."
 cd "$TMP_DIR"
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Logging setup for ShelterAgent - Python 2/3 compatible
+
+Records are handed to a bounded in-memory queue and written to the
+rotating log file and console by a background listener, so the agent
+loop never waits on disk. Repeated warnings and errors are collapsed.
+"""
+from __future__ import absolute_import
+import atexit
+import copy
+import logging
+import logging.handlers
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_state = {'listener': None, 'handlers': [], 'outputs': []}
+
+
+class DedupFilter(logging.Filter):
+    """
+    Collapse repeated WARNING+ records and cap their overall rate.
+
+    The first occurrence of a message is logged; repeats within the window
+    are counted and reported with the next occurrence after the window.
+    At most max_per_window distinct records pass per window.
+    """
+
+    def __init__(self, window=60, max_per_window=100):
+        logging.Filter.__init__(self)
+        self.window = window
+        self.max_per_window = max_per_window
+        self.lock = threading.Lock()
+        self.seen = {}  # key -> [first_logged_at, suppressed]
+        self.window_start = 0
+        self.window_count = 0
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+
+        now = time.time()
+        key = (record.name, record.levelno, record.msg)
+        with self.lock:
+            if now - self.window_start >= self.window:
+                self.window_start = now
+                self.window_count = 0
+                # Forget keys that have been quiet for a full window
+                for stale in [k for k, v in self.seen.items() if now - v[0] >= self.window and not v[1]]:
+                    del self.seen[stale]
+
+            entry = self.seen.get(key)
+            if entry is not None and now - entry[0] < self.window:
+                entry[1] += 1
+                return False
+
+            if self.window_count >= self.max_per_window:
+                self.dropped += 1
+                return False
+            self.window_count += 1
+
+            suppressed = entry[1] if entry is not None else 0
+            self.seen[key] = [now, 0]
+            dropped, self.dropped = self.dropped, 0
+
+        notes = []
+        if suppressed:
+            notes.append("repeated %d more times" % suppressed)
+        if dropped:
+            notes.append("%d other records suppressed" % dropped)
+        if notes:
+            record.msg = "%s (%s)" % (record.msg, ', '.join(notes))
+        return True
+
+
+class DroppingQueueHandler(logging.Handler):
+    """Queues records for the listener; drops them instead of blocking when full."""
+
+    def __init__(self, log_queue):
+        logging.Handler.__init__(self)
+        self.queue = log_queue
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            # Render message and traceback now; args may change before
+            # the listener gets to the record
+            record = copy.copy(record)
+            record.msg = self.format(record)
+            record.args = None
+            record.exc_info = None
+            record.exc_text = None
+            if self.dropped:
+                record.msg = "%s (%d log records dropped, queue full)" % (record.msg, self.dropped)
+        except Exception:
+            self.handleError(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+            self.dropped = 0
+        except queue.Full:
+            self.dropped += 1
+
+
+class QueueListener(object):
+    """Background thread that writes queued records to the output handlers."""
+
+    def __init__(self, log_queue, handlers):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.thread = threading.Thread(target=self._run, name='log-writer')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self, timeout=5):
+        """Write out queued records; returns False if the thread is still busy."""
+        try:
+            # Blocks while the queue is full; the writer is freeing space
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+
+def setup_logging(config=None):
+    """
+    (Re)configure the root logger from the config.yml logging section.
+
+    Keys: level, file, console, max_size_mb, backup_count, queue_size,
+    dedup_window, max_errors_per_window.
+    """
+    config = config or {}
+    level = getattr(logging, str(config.get('level', 'INFO')).upper(), logging.INFO)
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+
+    log_file = config.get('file', 'agent.log')
+    if log_file:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=int(config.get('max_size_mb', 10) * 1024 * 1024),
+            backupCount=config.get('backup_count', 5)
+        )
+        handlers.append(file_handler)
+    if config.get('console', True):
+        handlers.append(logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    shutdown_logging()
+    root = logging.getLogger()
+    root.setLevel(level)
+
+    log_queue = queue.Queue(maxsize=config.get('queue_size', 10000))
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(DedupFilter(
+        window=config.get('dedup_window', 60),
+        max_per_window=config.get('max_errors_per_window', 100)
+    ))
+    listener = QueueListener(log_queue, handlers)
+    listener.start()
+
+    root.addHandler(queue_handler)
+    _state['listener'] = listener
+    _state['handlers'] = [queue_handler]
+    _state['outputs'] = handlers
+
+
+def shutdown_logging():
+    """Flush queued records and detach handlers installed by setup_logging."""
+    root = logging.getLogger()
+    for handler in _state['handlers']:
+        root.removeHandler(handler)
+        handler.close()
+
+    listener = _state['listener']
+    stopped = listener is None or listener.stop()
+    _state['listener'] = None
+    # A writer stuck on a hung disk keeps its handlers; closing them under
+    # it would make the file handler reopen the log
+    if stopped:
+        for handler in _state['outputs']:
+            handler.close()
+    _state['handlers'] = []
+    _state['outputs'] = []
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1 @@
+"""Outputs package"""
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Persistent HTTPS connection - Python 2/3 compatible"""
+from __future__ import absolute_import
+import json
+import ssl
+import sys
+
+if sys.version_info[0] >= 3:
+    import http.client as httplib
+    import urllib.parse as urlparse
+else:
+    import httplib
+    import urlparse
+
+
+# HTTP statuses worth retrying besides 5xx; any other 4xx means the payload
+# itself is rejected. 401/403 point at credentials, which can be fixed
+RETRY_STATUSES = (401, 403, 408, 429)
+
+
+class HTTPError(Exception):
+    """Request reached the server but did not succeed."""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, "HTTP %d: %s" % (status, message))
+        self.status = status
+
+
+class Connection(object):
+    """Keep-alive connection to one server, reopened after any failure."""
+
+    def __init__(self, url, verify_ssl=True, timeout=10):
+        parts = urlparse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.context = None
+        if self.scheme == 'https':
+            if verify_ssl:
+                self.context = ssl.create_default_context()
+            else:
+                self.context = ssl._create_unverified_context()
+        self.conn = None
+
+    def _connect(self):
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.host, self.port, timeout=self.timeout,
+                                           context=self.context)
+        return httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def post(self, path, body, headers=None):
+        """
+        POST an already-serialised body to base_path + path.
+
+        Returns the decoded JSON response. Raises HTTPError for non-2xx
+        responses and socket/SSL errors for transport failures.
+        """
+        request_headers = {'Content-Type': 'application/json'}
+        if headers:
+            request_headers.update(headers)
+
+        if self.conn is None:
+            self.conn = self._connect()
+        try:
+            self.conn.request('POST', self.base_path + path, body, request_headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except Exception:
+            self.close()
+            raise
+
+        if response.getheader('connection', '').lower() == 'close':
+            self.close()
+
+        if sys.version_info[0] >= 3:
+            data = data.decode('utf-8', 'replace')
+
+        if not 200 <= response.status < 300:
+            raise HTTPError(response.status, data[:200] or response.reason)
+
+        try:
+            return json.loads(data) if data else {}
+        except ValueError:
+            raise HTTPError(response.status, "Invalid JSON response")
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
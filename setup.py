@@ -43,8 +43,8 @@ setup(
     url='https://github.com/shelteragent/agent',
     license='MIT',
     
-    packages=find_packages(),
-    py_modules=['agent'],
+    packages=find_packages(exclude=['benchmarks']),
+    py_modules=['agent', 'logconfig'],
     
     install_requires=read_requirements(),
     
@@ -70,7 +70,7 @@ setup(
     
     entry_points={
         'console_scripts': [
-            'shelteragent=agent:main' if hasattr(sys.modules.get('agent', object()), 'main') else None,
+            'shelteragent=agent:main',
         ],
     },
     
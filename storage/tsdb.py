@@ -0,0 +1,512 @@
+# -*- coding: utf-8 -*-
+"""
+Embedded local time-series store - Python 2/3 compatible
+
+Samples are grouped per series into compressed chunks (Gorilla style:
+delta-of-delta timestamps, XOR-encoded float values). Chunks are appended
+to time-partitioned block files and read back through mmap. Old blocks
+are dropped according to the retention limits.
+"""
+from __future__ import division
+import binascii
+import mmap
+import os
+import re
+import struct
+import time
+import zlib
+
+# Chunk record: magic, name_len, count, payload_len, crc32,
+# t_first_ms, t_last_ms, min, max, sum
+_CHUNK = struct.Struct('>4sHIIIqqddd')
+_MAGIC = b'SHC1'
+_BLOCK_SUFFIX = '.blk'
+
+_MASK64 = (1 << 64) - 1
+
+AGGREGATES = ('min', 'max', 'avg', 'sum', 'count', 'first', 'last')
+_SUMMARY_AGGREGATES = ('min', 'max', 'avg', 'sum', 'count')
+
+
+def _float_to_bits(value):
+    return struct.unpack('>Q', struct.pack('>d', value))[0]
+
+
+def _bits_to_float(bits):
+    return struct.unpack('>d', struct.pack('>Q', bits))[0]
+
+
+class BitWriter(object):
+    """Append-only bit stream."""
+
+    def __init__(self):
+        self.out = bytearray()
+        self.acc = 0
+        self.nbits = 0
+
+    def write(self, value, nbits):
+        self.acc = (self.acc << nbits) | value
+        self.nbits += nbits
+        while self.nbits >= 64:
+            self.nbits -= 64
+            self.out.extend(struct.pack('>Q', self.acc >> self.nbits))
+            self.acc &= (1 << self.nbits) - 1
+
+    def getvalue(self):
+        """Return the stream padded to a whole number of bytes."""
+        pad = (-self.nbits) % 8
+        acc = self.acc << pad
+        nbytes = (self.nbits + pad) // 8
+        tail = bytearray((acc >> (8 * (nbytes - i - 1))) & 0xff for i in range(nbytes))
+        return bytes(self.out + tail)
+
+
+class ChunkEncoder(object):
+    """Compresses one series' samples into a single chunk."""
+
+    def __init__(self, series, t_ms, value):
+        self.series = series
+        self.bits = BitWriter()
+        self.t_first = t_ms
+        self.t_last = t_ms
+        self.prev_delta = 0
+        self.prev_bits = _float_to_bits(value)
+        self.prev_lead = None
+        self.prev_trail = None
+        self.count = 1
+        self.vmin = value
+        self.vmax = value
+        self.vsum = value
+        self.bits.write(self.prev_bits, 64)
+
+    def append(self, t_ms, value):
+        delta = t_ms - self.t_last
+        self._write_dod(delta - self.prev_delta)
+        self.prev_delta = delta
+        self.t_last = t_ms
+
+        bits = _float_to_bits(value)
+        self._write_xor(bits ^ self.prev_bits)
+        self.prev_bits = bits
+
+        self.count += 1
+        if value < self.vmin:
+            self.vmin = value
+        if value > self.vmax:
+            self.vmax = value
+        self.vsum += value
+
+    def _write_dod(self, dod):
+        if dod == 0:
+            self.bits.write(0, 1)
+        elif -63 <= dod <= 64:
+            self.bits.write((0b10 << 7) | (dod + 63), 9)
+        elif -255 <= dod <= 256:
+            self.bits.write((0b110 << 9) | (dod + 255), 12)
+        elif -2047 <= dod <= 2048:
+            self.bits.write((0b1110 << 12) | (dod + 2047), 16)
+        else:
+            self.bits.write(0b1111, 4)
+            self.bits.write(dod & _MASK64, 64)
+
+    def _write_xor(self, xor):
+        if xor == 0:
+            self.bits.write(0, 1)
+            return
+
+        lead = min(64 - xor.bit_length(), 31)
+        trail = (xor & -xor).bit_length() - 1
+
+        if self.prev_lead is not None and lead >= self.prev_lead and trail >= self.prev_trail:
+            self.bits.write(0b10, 2)
+            self.bits.write(xor >> self.prev_trail, 64 - self.prev_lead - self.prev_trail)
+        else:
+            sig = 64 - lead - trail
+            self.bits.write((0b11 << 11) | (lead << 6) | (sig - 1), 13)
+            self.bits.write(xor >> trail, sig)
+            self.prev_lead = lead
+            self.prev_trail = trail
+
+    def header(self):
+        return {
+            'series': self.series,
+            'count': self.count,
+            't_first': self.t_first,
+            't_last': self.t_last,
+            'min': self.vmin,
+            'max': self.vmax,
+            'sum': self.vsum,
+        }
+
+
+def decode_chunk(payload, count, t_first):
+    """Decode a chunk payload into a list of (t_ms, value) tuples."""
+    # The whole payload is read as one integer and bits are taken from the
+    # top down; this loop dominates range-scan time so it is kept flat
+    data = int(binascii.hexlify(payload), 16) if payload else 0
+    pos = len(payload) * 8
+
+    pos -= 64
+    prev_bits = (data >> pos) & _MASK64
+    t = t_first
+    samples = [(t, _bits_to_float(prev_bits))]
+    delta = 0
+    lead = 0
+    trail = 0
+    sig = 64
+
+    for _ in range(count - 1):
+        pos -= 1
+        if not (data >> pos) & 1:
+            dod = 0
+        else:
+            pos -= 1
+            if not (data >> pos) & 1:
+                pos -= 7
+                dod = ((data >> pos) & 0x7f) - 63
+            else:
+                pos -= 1
+                if not (data >> pos) & 1:
+                    pos -= 9
+                    dod = ((data >> pos) & 0x1ff) - 255
+                else:
+                    pos -= 1
+                    if not (data >> pos) & 1:
+                        pos -= 12
+                        dod = ((data >> pos) & 0xfff) - 2047
+                    else:
+                        pos -= 64
+                        dod = (data >> pos) & _MASK64
+                        if dod >= 1 << 63:
+                            dod -= 1 << 64
+        delta += dod
+        t += delta
+
+        pos -= 1
+        if (data >> pos) & 1:
+            pos -= 1
+            if (data >> pos) & 1:
+                pos -= 11
+                control = (data >> pos) & 0x7ff
+                lead = control >> 6
+                sig = (control & 0x3f) + 1
+                trail = 64 - lead - sig
+            pos -= sig
+            prev_bits ^= ((data >> pos) & ((1 << sig) - 1)) << trail
+        samples.append((t, _bits_to_float(prev_bits)))
+
+    if pos < 0:
+        raise ValueError("Read past end of chunk")
+    return samples
+
+
+def parse_duration(text):
+    """Parse a duration like '90', '30s', '5m', '2h', '7d' into seconds."""
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*$', str(text))
+    if not match:
+        raise ValueError("Invalid duration: %s" % text)
+    units = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    return float(match.group(1)) * units[match.group(2)]
+
+
+def parse_time(text, now=None):
+    """Parse 'now', a relative offset ('now-1h' or '-1h') or epoch seconds."""
+    if now is None:
+        now = time.time()
+    text = str(text).strip()
+    if text.startswith('now'):
+        text = text[3:].strip()
+        if not text:
+            return now
+    if text.startswith('-'):
+        return now - parse_duration(text[1:])
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError("Invalid time: %s" % text)
+
+
+class TimeSeriesStore(object):
+    """Log-structured local store for agent metrics."""
+
+    def __init__(self, path, block_duration=7200, retention_days=7,
+                 max_size_mb=100, chunk_size=120, flush_interval=60, create=True):
+        self.path = path
+        self.block_ms = int(block_duration * 1000)
+        self.retention_ms = int(retention_days * 86400 * 1000)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.chunk_size = chunk_size
+        self.flush_ms = int(flush_interval * 1000)
+
+        self.heads = {}
+        self._file = None
+        self._file_block = None
+
+        # Readers (agent.py query) must not leave an empty store behind
+        if create and not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    # Writing
+
+    def append(self, series, timestamp, value):
+        """Append one sample. Returns False if it is out of order."""
+        t_ms = int(round(timestamp * 1000))
+        value = float(value)
+        head = self.heads.get(series)
+
+        if head is not None:
+            if t_ms <= head.t_last:
+                return False
+            # Chunks cover aligned flush windows so that aggregates over
+            # aligned steps can be answered from chunk summaries alone
+            if (head.count >= self.chunk_size
+                    or t_ms // self.flush_ms != head.t_first // self.flush_ms
+                    or self._block_of(t_ms) != self._block_of(head.t_first)):
+                self._write_chunk(head)
+                head = None
+
+        if head is None:
+            self.heads[series] = ChunkEncoder(series, t_ms, value)
+        else:
+            head.append(t_ms, value)
+        return True
+
+    def append_metrics(self, metrics, timestamp):
+        """Append the list produced by ShelterAgent.collect_metrics()."""
+        for metric in metrics:
+            self.append(metric['metric_type'], timestamp, metric['value'])
+
+    def flush(self):
+        """Write all open chunks to disk."""
+        for head in list(self.heads.values()):
+            self._write_chunk(head)
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._file_block = None
+
+    def _block_of(self, t_ms):
+        return t_ms - t_ms % self.block_ms
+
+    def _block_file(self, block):
+        return os.path.join(self.path, '%d%s' % (block // 1000, _BLOCK_SUFFIX))
+
+    def _write_chunk(self, head):
+        del self.heads[head.series]
+
+        block = self._block_of(head.t_first)
+        if block != self._file_block:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self._block_file(block), 'ab')
+            self._file_block = block
+            self.enforce_retention(head.t_first / 1000.0)
+
+        name = head.series.encode('utf-8')
+        payload = head.bits.getvalue()
+        record = _CHUNK.pack(
+            _MAGIC, len(name), head.count, len(payload),
+            zlib.crc32(payload) & 0xffffffff,
+            head.t_first, head.t_last, head.vmin, head.vmax, head.vsum
+        )
+        self._file.write(record + name + payload)
+        self._file.flush()
+
+    def enforce_retention(self, now=None):
+        """Delete blocks older than the retention period or over the size cap."""
+        if now is None:
+            now = time.time()
+        cutoff = int(now * 1000) - self.retention_ms
+
+        blocks = self.blocks()
+        kept = []
+        for block, filename in blocks:
+            if block + self.block_ms <= cutoff and block != self._file_block:
+                self._remove(filename)
+            else:
+                kept.append((block, filename))
+
+        total = 0
+        sizes = []
+        for block, filename in kept:
+            try:
+                size = os.path.getsize(filename)
+            except OSError:
+                size = 0
+            sizes.append((block, filename, size))
+            total += size
+
+        for block, filename, size in sizes:
+            if total <= self.max_size:
+                break
+            if block == self._file_block:
+                continue
+            self._remove(filename)
+            total -= size
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    # Reading
+
+    def blocks(self):
+        """Return [(block_start_ms, filename)] sorted by time."""
+        blocks = []
+        if not os.path.isdir(self.path):
+            return blocks
+        for name in os.listdir(self.path):
+            if not name.endswith(_BLOCK_SUFFIX):
+                continue
+            try:
+                block = int(name[:-len(_BLOCK_SUFFIX)]) * 1000
+            except ValueError:
+                continue
+            blocks.append((block, os.path.join(self.path, name)))
+        blocks.sort()
+        return blocks
+
+    def _iter_chunks(self, series, start_ms, end_ms):
+        """Yield (header, payload) for chunks overlapping [start_ms, end_ms]."""
+        wanted = series.encode('utf-8') if series is not None else None
+
+        for block, filename in self.blocks():
+            if block > end_ms or block + self.block_ms <= start_ms:
+                continue
+            for chunk in self._read_block(filename, wanted, start_ms, end_ms):
+                yield chunk
+
+        for head in list(self.heads.values()):
+            if series is not None and head.series != series:
+                continue
+            if head.t_last < start_ms or head.t_first > end_ms:
+                continue
+            yield head.header(), head.bits.getvalue()
+
+    def _read_block(self, filename, wanted, start_ms, end_ms):
+        with open(filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                offset = 0
+                while offset + _CHUNK.size <= size:
+                    (magic, name_len, count, payload_len, crc,
+                     t_first, t_last, vmin, vmax, vsum) = _CHUNK.unpack_from(mm, offset)
+                    name_start = offset + _CHUNK.size
+                    payload_start = name_start + name_len
+                    offset = payload_start + payload_len
+                    # Stop at a torn or foreign tail
+                    if magic != _MAGIC or offset > size:
+                        break
+
+                    name = mm[name_start:payload_start]
+                    if wanted is not None and name != wanted:
+                        continue
+                    if t_last < start_ms or t_first > end_ms:
+                        continue
+
+                    payload = mm[payload_start:offset]
+                    if zlib.crc32(payload) & 0xffffffff != crc:
+                        continue
+
+                    yield {
+                        'series': name.decode('utf-8'),
+                        'count': count,
+                        't_first': t_first,
+                        't_last': t_last,
+                        'min': vmin,
+                        'max': vmax,
+                        'sum': vsum,
+                    }, payload
+            finally:
+                mm.close()
+
+    def series(self):
+        """Return the sorted list of stored series names."""
+        names = set()
+        for header, _ in self._iter_chunks(None, 0, 1 << 62):
+            names.add(header['series'])
+        return sorted(names)
+
+    def query(self, series, start, end):
+        """Return [(timestamp, value)] for series within [start, end]."""
+        start_ms = int(start * 1000)
+        end_ms = int(end * 1000)
+        samples = []
+        for header, payload in self._iter_chunks(series, start_ms, end_ms):
+            for t, v in decode_chunk(payload, header['count'], header['t_first']):
+                if start_ms <= t <= end_ms:
+                    samples.append((t / 1000.0, v))
+        samples.sort(key=lambda s: s[0])
+        return samples
+
+    def aggregate(self, series, start, end, func='avg', step=None):
+        """
+        Aggregate a series over [start, end].
+
+        Returns a single value, or [(bucket_start, value)] when step is
+        given; buckets are aligned to multiples of step. Chunks lying
+        entirely inside one bucket are answered from their stored summary
+        without being decoded.
+        """
+        if func not in AGGREGATES:
+            raise ValueError("Unknown aggregate: %s" % func)
+
+        start_ms = int(start * 1000)
+        end_ms = int(end * 1000)
+        step_ms = int(step * 1000) if step is not None else None
+        if step_ms is not None and step_ms <= 0:
+            raise ValueError("Step must be at least 1ms: %s" % step)
+        buckets = {}
+
+        def bucket_of(t_ms):
+            return t_ms // step_ms if step_ms else 0
+
+        for header, payload in self._iter_chunks(series, start_ms, end_ms):
+            if (func in _SUMMARY_AGGREGATES
+                    and header['t_first'] >= start_ms and header['t_last'] <= end_ms
+                    and bucket_of(header['t_first']) == bucket_of(header['t_last'])):
+                _merge(buckets, bucket_of(header['t_first']), header)
+                continue
+
+            for t, v in decode_chunk(payload, header['count'], header['t_first']):
+                if start_ms <= t <= end_ms:
+                    _merge(buckets, bucket_of(t), {
+                        'count': 1, 't_first': t, 't_last': t,
+                        'min': v, 'max': v, 'sum': v, 'first': v, 'last': v,
+                    })
+
+        if step_ms is None:
+            return _finalize(buckets[0], func) if buckets else None
+        return [(b * step_ms / 1000.0, _finalize(buckets[b], func))
+                for b in sorted(buckets)]
+
+
+def _merge(buckets, key, stats):
+    acc = buckets.get(key)
+    if acc is None:
+        buckets[key] = dict(stats)
+        return
+    acc['count'] += stats['count']
+    acc['sum'] += stats['sum']
+    acc['min'] = min(acc['min'], stats['min'])
+    acc['max'] = max(acc['max'], stats['max'])
+    if stats['t_first'] < acc['t_first']:
+        acc['t_first'] = stats['t_first']
+        acc['first'] = stats.get('first')
+    if stats['t_last'] >= acc['t_last']:
+        acc['t_last'] = stats['t_last']
+        acc['last'] = stats.get('last')
+
+
+def _finalize(acc, func):
+    if func == 'avg':
+        return acc['sum'] / acc['count']
+    return acc[func]